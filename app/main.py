@@ -1,13 +1,32 @@
 ﻿# app/main.py — clean, stable API
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse
 from datetime import datetime
-from collections import Counter
-import json, csv
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import csv, heapq, math, threading
+import numpy as np
+import orjson
 
+try:
+    import pyarrow.parquet as pq   # optional (not in requirements.txt): read the Parquet sidecar
+except ImportError:
+    pq = None
 
-app = FastAPI(title="AquiferPulse")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # warm the basins template; a missing/broken file must not stop the API from booting
+    try:
+        _basins()
+    except HTTPException:
+        pass
+    yield
+
+app = FastAPI(title="AquiferPulse", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,11 +41,13 @@ STATIC_DIR    = DATA / "static"
 
 ASI_LATEST = PROCESSED_DIR / "asi_latest.geojson"
 ASI_TABLE  = PROCESSED_DIR / "asi_table.csv"
+ASI_PARQUET = PROCESSED_DIR / "asi_table.parquet"  # same rows, columnar; written by compute_asi.py
+ASI_META   = PROCESSED_DIR / "asi_meta.json"   # date range + feature count, written by compute_asi.py
 BASINS     = STATIC_DIR / "basins.geojson"
 
 # ----- Helpers -----
 def _read_json(path: Path):
-    return json.loads(path.read_text(encoding="utf-8"))
+    return orjson.loads(path.read_bytes())
 
 def _r(x, nd=3):
     try:
@@ -34,69 +55,227 @@ def _r(x, nd=3):
             return None
         if isinstance(x, str) and x.strip().lower() in {"", "none", "nan"}:
             return None
-        return round(float(x), nd)
+        v = float(x)
+        return None if math.isnan(v) else round(v, nd)
     except Exception:
         return None
 
+# ----- Table cache (asi_table parsed once, re-read when the file changes) -----
+VALUE_COLS = ("twsa_z", "sm_z", "rain_z", "rain_def_z", "asi")
+
+# month builds keep an int8 code per feature (index into CLASSES) for the summary's bincount
+CLASSES      = ("alert", "watch", "normal", "no-data")
+CLASS_CODE   = {c: i for i, c in enumerate(CLASSES)}
+NO_DATA_CODE = CLASS_CODE["no-data"]
+
+_TABLE_LOCK  = threading.Lock()
+_TABLE_CACHE = {"key": None, "by_date": {}, "by_basin": {}, "dmin": None, "dmax": None, "months": None}
+
+def _csv_rows(path: Path):
+    """asi_table.csv -> (basin_id, date, [values...], class) tuples, via csv.reader."""
+    with path.open("r", encoding="utf-8", newline="") as fh:
+        rdr = csv.reader(fh)
+        header = next(rdr, [])
+        idx = {name: i for i, name in enumerate(header)}
+        if "date" not in idx or "basin_id" not in idx:
+            return  # no key columns -> empty table, like DictReader's .get() gave
+        # resolve column positions once; missing columns map to None
+        date_i, bid_i, class_i = idx["date"], idx["basin_id"], idx.get("class")
+        value_i = [idx.get(c) for c in VALUE_COLS]
+        key_max, width = max(date_i, bid_i), len(header)
+        for row in rdr:
+            if len(row) <= key_max:
+                continue  # blank or truncated line
+            if len(row) < width:
+                row += [None] * (width - len(row))  # short row: missing cells read as None
+            yield (row[bid_i], row[date_i],
+                   [(row[i] if i is not None else None) for i in value_i],
+                   (row[class_i] if class_i is not None else None))
+
+def _parquet_rows(path: Path):
+    """asi_table.parquet -> same tuples as _csv_rows, already typed by pyarrow."""
+    tbl = pq.read_table(path)
+    names = set(tbl.column_names)
+    if "date" not in names or "basin_id" not in names:
+        return iter(())  # no key columns -> empty table, same as _csv_rows
+    # other missing columns read as None, same as a missing CSV column
+    n = tbl.num_rows
+    col = lambda c: tbl.column(c).to_pylist() if c in names else [None] * n
+    return zip(col("basin_id"), col("date"), zip(*(col(c) for c in VALUE_COLS)), col("class"))
+
+def _parse_table(rows, key):
+    """Single pass over the table rows -> rows indexed by date and by basin; then min/max date."""
+    # date -> {basin_id: row} is filled directly, so the month builder never re-indexes rows
+    by_date, by_basin = defaultdict(dict), defaultdict(list)
+    for bid, d, values, cls in rows:
+        d = (d or "").strip()[:10]  # 'YYYY-MM-DD' or 'YYYY-MM-DD hh:mm:ss'
+        if not d:
+            continue
+        bid = str(bid)
+        rec = {"date": d}
+        for c, v in zip(VALUE_COLS, values):
+            rec[c] = _r(v)
+        rec["class"] = cls
+        by_date[d][bid] = rec
+        by_basin[bid].append(rec)
+    # min/max over the distinct dates (ISO strings sort chronologically), not a per-row compare
+    dmin, dmax = (min(by_date), max(by_date)) if by_date else (None, None)
+    table = {"key": key, "by_date": dict(by_date), "by_basin": dict(by_basin),
+             "dmin": dmin, "dmax": dmax}
+    # month builds are cached per table snapshot, so a rebuild can never outlive its table
+    table["months"] = lru_cache(maxsize=64)(
+        lambda target: _build_geojson_for_date(target, table["by_date"].get(target, {})))
+    return table
+
+def _load_table():
+    """
+    Return the cached table, re-parsing only if the source changed on disk.
+    Reads the Parquet sidecar when pyarrow is installed and it is at least as new as the CSV.
+    """
+    global _TABLE_CACHE
+    if not ASI_TABLE.exists():
+        raise HTTPException(404, detail="asi_table.csv not found. Run scripts/compute_asi.py")
+    src, mtime = ASI_TABLE, ASI_TABLE.stat().st_mtime_ns
+    if pq is not None and ASI_PARQUET.exists() and ASI_PARQUET.stat().st_mtime_ns >= mtime:
+        src, mtime = ASI_PARQUET, ASI_PARQUET.stat().st_mtime_ns
+    key = (src, mtime)
+    with _TABLE_LOCK:
+        if _TABLE_CACHE["key"] != key:
+            rows = _parquet_rows(src) if src == ASI_PARQUET else _csv_rows(src)
+            _TABLE_CACHE = _parse_table(rows, key)
+        return _TABLE_CACHE
+
+_META_CACHE = {"mtime": None, "data": None}
+
+def _table_meta():
+    """
+    asi_meta.json if it describes the current asi_table.csv (same mtime), else None.
+    Only consulted while the table cache is cold; once warm, the cache answers directly.
+    """
+    global _META_CACHE
+    if _TABLE_CACHE["key"] is not None:
+        return None
+    try:
+        mtime = ASI_META.stat().st_mtime_ns
+        if _META_CACHE["mtime"] != mtime:
+            _META_CACHE = {"mtime": mtime, "data": _read_json(ASI_META)}
+        meta = _META_CACHE["data"]
+        if meta.get("mtime") == ASI_TABLE.stat().st_mtime_ns:
+            return meta
+    except Exception:
+        pass
+    return None
+
+# ----- Basins template (parsed once on first use, never mutated) -----
+NO_DATA = {"twsa_z": None, "sm_z": None, "rain_z": None, "rain_def_z": None,
+           "asi": None, "class": "no-data"}
+
+_BASINS_LOCK = threading.Lock()
+
+def _basins():
+    """
+    Return (basins FeatureCollection, {basin_id: [feature positions]}).
+    Loaded once; only the builders that need geometry fail if basins.geojson is missing.
+    """
+    with _BASINS_LOCK:
+        if getattr(app.state, "basins", None) is None:
+            try:
+                basins = _read_json(BASINS)
+            except Exception:
+                raise HTTPException(500, detail="basins.geojson missing or unreadable")
+            # basin_id -> positions in basins["features"] (ids may repeat), so a month only
+            # touches basins it has rows for
+            index = defaultdict(list)
+            for i, f in enumerate(basins.get("features", [])):
+                index[str((f.get("properties") or {}).get("basin_id"))].append(i)
+            app.state.basin_index = dict(index)
+            app.state.basins = basins
+        return app.state.basins, app.state.basin_index
+
+def _with_props(basins, props):
+    """
+    New FeatureCollection whose features get props(old_properties) as properties.
+    Geometry and other feature members are shared with the template by reference.
+    """
+    return {**basins, "features": [{**f, "properties": props(f.get("properties") or {})}
+                                   for f in basins.get("features", [])]}
+
 # ----- Core builders -----
+_LATEST_CACHE = {"mtime": None, "data": None}
+
 def latest_geojson():
     """Return the latest FeatureCollection, falling back to basins with 'no-data'."""
-    # Primary: prebuilt file from compute_asi.py
+    global _LATEST_CACHE
+    # Primary: prebuilt file from compute_asi.py (parsed once per mtime; read it, don't mutate it)
     if ASI_LATEST.exists():
         try:
-            return _read_json(ASI_LATEST)
+            mtime = ASI_LATEST.stat().st_mtime_ns
+            if _LATEST_CACHE["mtime"] != mtime:
+                _LATEST_CACHE = {"mtime": mtime, "data": _read_json(ASI_LATEST)}
+            return _LATEST_CACHE["data"]
         except Exception:
             pass
 
     # Fallback: basins with no-data props
-    gj = _read_json(BASINS)
-    for f in gj.get("features", []):
-        p = f.setdefault("properties", {})
-        p.update({"date": None, "twsa_z": None, "sm_z": None,
-                  "rain_z": None, "rain_def_z": None, "asi": None, "class": "no-data"})
-    return gj
+    return _with_props(_basins()[0], lambda p: {**p, **NO_DATA, "date": None})
 
-def geojson_for_date(date: str):
-    """
-    Build a FeatureCollection for a specific month (YYYY-MM or YYYY-MM-01)
-    from basins.geojson + asi_table.csv.
-    """
-    if not ASI_TABLE.exists():
-        raise HTTPException(404, detail="asi_table.csv not found. Run scripts/compute_asi.py")
+def latest_response():
+    """Send asi_latest.geojson as-is (sendfile + ETag/Last-Modified); build the fallback if missing."""
+    if ASI_LATEST.exists():
+        return FileResponse(ASI_LATEST, media_type="application/json",
+                            headers={"Cache-Control": "public, max-age=300"})
+    return latest_geojson()
 
-    # normalize to first-of-month
+def _normalize_month(date: str) -> str:
+    """'YYYY-MM' or 'YYYY-MM-01' -> 'YYYY-MM-01' (first-of-month)."""
     try:
         dt = datetime.strptime(date[:7] + "-01", "%Y-%m-%d")
-        target = dt.strftime("%Y-%m-%d")
+        return dt.strftime("%Y-%m-%d")
     except Exception:
         raise HTTPException(400, detail="date must be YYYY-MM or YYYY-MM-01")
 
-    # read rows for that month only
-    rows = []
-    with ASI_TABLE.open("r", encoding="utf-8", newline="") as fh:
-        rdr = csv.DictReader(fh)
-        for r in rdr:
-            if r.get("date") == target:
-                rows.append(r)
-    by_id = {str(r["basin_id"]): r for r in rows}
-
-    gj = _read_json(BASINS)
-    for f in gj.get("features", []):
-        p = f.setdefault("properties", {})
-        bid = str(p.get("basin_id"))
-        r = by_id.get(bid)
-        if r:
-            p.update({
-                "date": target,
-                "twsa_z": _r(r.get("twsa_z")), "sm_z": _r(r.get("sm_z")),
-                "rain_z": _r(r.get("rain_z")), "rain_def_z": _r(r.get("rain_def_z")),
-                "asi": _r(r.get("asi")), "class": r.get("class"),
-                "name": p.get("name") or bid,
-            })
-        else:
-            p.update({"date": target, "twsa_z": None, "sm_z": None,
-                      "rain_z": None, "rain_def_z": None, "asi": None, "class": "no-data"})
-    return gj
+def _build_geojson_for_date(target: str, by_id: dict):
+    """
+    Build the FeatureCollection for a normalized month from basins.geojson + that month's
+    table rows ({basin_id: row}). Returns (geojson, serialized bytes, per-feature class codes);
+    codes is None when a label falls outside CLASSES, and the summary then counts labels.
+    """
+    basins, index = _basins()
+    features = basins.get("features", [])
+
+    # every basin starts as no-data for the month; only basins with rows get overwritten
+    props = [{**(f.get("properties") or {}), **NO_DATA, "date": target} for f in features]
+    codes = np.full(len(features), NO_DATA_CODE, dtype=np.int8)
+    for bid, r in by_id.items():
+        code = CLASS_CODE.get(r["class"])
+        if code is None:
+            codes = None
+        for i in index.get(bid, ()):
+            p = props[i]
+            p.update(r)
+            p["name"] = p.get("name") or bid
+            if codes is not None:
+                codes[i] = code
+
+    gj = {**basins, "features": [{**f, "properties": p} for f, p in zip(features, props)]}
+    body = orjson.dumps(gj)
+    return gj, body, codes
+
+def _month(date: str):
+    """Cached (geojson, bytes, class codes) for a month; shared with the cache, don't mutate."""
+    months = _load_table()["months"]  # 404 if the table is missing
+    return months(_normalize_month(date))
+
+def geojson_for_date(date: str):
+    """
+    FeatureCollection for a specific month (YYYY-MM or YYYY-MM-01).
+    The result is shared with the month cache: read it, don't mutate it.
+    """
+    return _month(date)[0]
+
+def geojson_response(date: str):
+    """Same as geojson_for_date, but returns the cached pre-serialized bytes."""
+    return Response(content=_month(date)[1], media_type="application/json")
 
 # ----- Routes -----
 @app.get("/")
@@ -109,8 +288,17 @@ def health():
         return {"exists": p.exists(), "size": (p.stat().st_size if p.exists() else 0), "path": str(p)}
     feat_count = None
     if ASI_LATEST.exists():
-        try: feat_count = len(_read_json(ASI_LATEST).get("features", []))
-        except Exception: feat_count = -1
+        # cheap path: count recorded by compute_asi.py for this exact asi_latest.geojson;
+        # a missing/stale/broken sidecar just means counting the file itself
+        try:
+            meta = _read_json(ASI_META)
+            if meta["latest_mtime"] == ASI_LATEST.stat().st_mtime_ns:
+                feat_count = int(meta["feature_count"])
+        except Exception:
+            feat_count = None
+        if feat_count is None:
+            try: feat_count = len(_read_json(ASI_LATEST).get("features", []))
+            except Exception: feat_count = -1
     return {
         "cwd": str(Path().resolve()),
         "root": str(ROOT),
@@ -123,12 +311,12 @@ def health():
 
 @app.get("/asi/latest")
 def asi_latest():
-    return latest_geojson()
+    return latest_response()
 
 @app.get("/asi/at")
 def asi_at(date: str):
     """GeoJSON for a given month (YYYY-MM or YYYY-MM-01)."""
-    return geojson_for_date(date)
+    return geojson_response(date)
 
 @app.get("/asi/top10")
 def asi_top10(limit: int = 10, classes: str = "alert,watch", date: str | None = None):
@@ -138,7 +326,7 @@ def asi_top10(limit: int = 10, classes: str = "alert,watch", date: str | None =
     for f in gj.get("features", []):
         p = f.get("properties", {}) or {}
         asi = p.get("asi")
-        if isinstance(asi, (int, float)):
+        if isinstance(asi, (int, float)) and (not wanted or p.get("class") in wanted):
             rows.append({
                 "basin_id": p.get("basin_id") or f.get("id"),
                 "name": p.get("name"),
@@ -146,82 +334,63 @@ def asi_top10(limit: int = 10, classes: str = "alert,watch", date: str | None =
                 "class": p.get("class"),
                 "date": p.get("date"),
             })
-    if wanted:
-        rows = [r for r in rows if r["class"] in wanted]
-    rows.sort(key=lambda r: r["asi"])
-    return rows[:max(0, int(limit))]
+    # partial selection: O(N log limit), same order as sorted(rows)[:limit]
+    return heapq.nsmallest(max(0, int(limit)), rows, key=lambda r: r["asi"])
 
 @app.get("/asi/summary")
 def asi_summary(date: str | None = None):
-    gj = geojson_for_date(date) if date else latest_geojson()
-    classes = [(f.get("properties") or {}).get("class", "no-data") for f in gj.get("features", [])]
-    counts = Counter(classes)
-    as_of = next(((f.get("properties") or {}).get("date")
-                  for f in gj.get("features", [])
-                  if (f.get("properties") or {}).get("date")), None)
-    asis = [ (f.get("properties") or {}).get("asi")
-             for f in gj.get("features", [])
-             if isinstance((f.get("properties") or {}).get("asi"), (int, float)) ]
+    # month builds carry int class codes (unless a label is unknown); the latest file only has labels
+    gj, _, codes = _month(date) if date else (latest_geojson(), None, None)
+    classes, asis, as_of = [], [], None
+    for f in gj.get("features", []):
+        p = f.get("properties") or {}
+        if codes is None:
+            classes.append(p.get("class", "no-data"))
+        a = p.get("asi")
+        if isinstance(a, (int, float)):
+            asis.append(a)
+        if as_of is None and p.get("date"):
+            as_of = p["date"]
+    if codes is not None:
+        n = np.bincount(codes, minlength=len(CLASSES)).tolist()
+        counts = {c: k for c, k in zip(CLASSES, n) if k}
+    else:
+        counts = Counter(classes)
     return {"as_of": as_of, "counts": counts, "min_asi": (min(asis) if asis else None), "max_asi": (max(asis) if asis else None)}
 @app.get("/asi/latest_date")
 def asi_latest_date():
     """Return the max date present in data/processed/asi_table.csv."""
-    if not ASI_TABLE.exists():
-        raise HTTPException(404, detail="asi_table.csv not found. Run scripts/compute_asi.py")
-    latest = None
-    with ASI_TABLE.open("r", encoding="utf-8", newline="") as fh:
-        rdr = csv.DictReader(fh)
-        for r in rdr:
-            d = r.get("date")
-            if d:
-                latest = d if latest is None else (d if d > latest else latest)
-    return {"latest": latest}
+    meta = _table_meta()
+    if meta:
+        return {"latest": meta["max"]}
+    return {"latest": _load_table()["dmax"]}
 @app.get("/asi/date_range")
 def asi_date_range():
     """Return min/max dates present in data/processed/asi_table.csv."""
-    if not ASI_TABLE.exists():
-        raise HTTPException(404, detail="asi_table.csv not found. Run scripts/compute_asi.py")
-    dmin, dmax = None, None
-    with ASI_TABLE.open("r", encoding="utf-8", newline="") as fh:
-        rdr = csv.DictReader(fh)
-        for r in rdr:
-            d = (r.get("date") or "").strip()[:10]  # 'YYYY-MM-DD' or 'YYYY-MM-DD hh:mm:ss'
-            if not d:
-                continue
-            dmin = d if dmin is None or d < dmin else dmin
-            dmax = d if dmax is None or d > dmax else dmax
-    return {"min": dmin, "max": dmax}
+    meta = _table_meta()
+    if meta:
+        return {"min": meta["min"], "max": meta["max"]}
+    table = _load_table()
+    return {"min": table["dmin"], "max": table["dmax"]}
 
 
 @app.get("/asi/history")
 def asi_history(basin_id: str):
-    if not ASI_TABLE.exists():
-        raise HTTPException(404, detail="asi_table.csv not found. Run scripts/compute_asi.py")
-    out = []
-    with ASI_TABLE.open("r", encoding="utf-8", newline="") as fh:
-        rdr = csv.DictReader(fh)
-        for row in rdr:
-            if str(row.get("basin_id")) == str(basin_id):
-                out.append({
-                    "date": row.get("date"),
-                    "twsa_z": _r(row.get("twsa_z")), "sm_z": _r(row.get("sm_z")),
-                    "rain_z": _r(row.get("rain_z")), "rain_def_z": _r(row.get("rain_def_z")),
-                    "asi": _r(row.get("asi")), "class": row.get("class"),
-                })
-    if not out:
+    rows = _load_table()["by_basin"].get(str(basin_id))
+    if not rows:
         raise HTTPException(404, detail=f"No history for basin_id={basin_id}")
-    return out
+    return rows
 # --- Backwards-compat so the existing HTML keeps working ---
 
 @app.get("/api/asi")
 def legacy_api_asi():
     # old URL -> latest GeoJSON
-    return latest_geojson()
+    return latest_response()
 
 @app.get("/api/asi_at")
 def legacy_api_asi_at(date: str):
     # old URL with ?date=YYYY-MM -> month GeoJSON
-    return geojson_for_date(date)
+    return geojson_response(date)
 
 @app.get("/api/summary")
 def legacy_api_summary(date: str | None = None):
@@ -1,6 +1,12 @@
 # scripts/compute_asi.py  — robust inputs + renormalized ASI + latest-with-coverage
 from pathlib import Path
-import pandas as pd, numpy as np, json
+import os
+import pandas as pd, numpy as np, orjson
+
+try:
+    from pyarrow import csv as pacsv   # optional: multi-threaded CSV parser
+except ImportError:
+    pacsv = None
 
 ROOT = Path(__file__).resolve().parents[1]
 INTERIM   = ROOT / "data" / "interim"
@@ -9,16 +15,31 @@ STATIC    = ROOT / "data" / "static"
 
 BASINS_GJ = STATIC / "basins.geojson"
 TABLE_OUT = PROCESSED / "asi_table.csv"
+TABLE_PQ  = PROCESSED / "asi_table.parquet"
 LATEST_GJ = PROCESSED / "asi_latest.geojson"
+META_OUT  = PROCESSED / "asi_meta.json"
 
 # weights (used, but re-normalized if a component is missing)
 W_TWSA, W_SM, W_RAIN = 0.4, 0.4, 0.2
 ALERT_T, WATCH_T = -1.0, -0.5
+CLASSES = ["alert", "watch", "normal", "no-data"]
+
+def _write_atomic(path, write):
+    # write to a temp file next to `path`, then swap it in: the API never sees a half-written file
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
 
 def _read_csv(path, needed):
     if not path.exists():
         print(f"[WARN] missing: {path}")
         return pd.DataFrame(columns=needed)
+    if pacsv is not None:
+        tbl = pacsv.read_csv(path, read_options=pacsv.ReadOptions(use_threads=True))
+        return tbl.to_pandas()
     df = pd.read_csv(path)
     return df
 
@@ -27,16 +48,29 @@ def _to_month(s):
     return d.dt.to_period("M").dt.to_timestamp()
 
 def _z_by_basin(df, col):
-    def z(s):
-        sd = s.std(ddof=0)
-        return (s - s.mean())/sd if (sd is not None and sd > 0) else pd.Series([np.nan]*len(s), index=s.index)
-    return df.groupby("basin_id")[col].transform(z)
+    # vectorized per-basin z-score; basins with zero spread get NaN
+    g  = df.groupby("basin_id")[col]
+    mu = g.transform("mean")
+    sd = g.transform("std", ddof=0)
+    ok = sd > 0
+    return (df[col] - mu).where(ok) / sd.where(ok)
 
 def _classify(asi):
-    if pd.isna(asi): return "no-data"
-    if asi <= ALERT_T: return "alert"
-    if asi <= WATCH_T: return "watch"
-    return "normal"
+    # vectorized: array of ASI values -> array of class labels
+    a = np.asarray(asi, dtype=float)
+    return np.select([np.isnan(a), a <= ALERT_T, a <= WATCH_T],
+                     ["no-data", "alert", "watch"], default="normal")
+
+def _apply_overlay(basins, overlay, no_data):
+    # new FeatureCollection: basin props + overlay[basin_id] (or no_data); geometry shared, not copied
+    feats = []
+    for f in basins.get("features", []):
+        p = f.get("properties") or {}
+        bid = str(p.get("basin_id"))
+        extra = overlay.get(bid)
+        props = {**p, **extra, "name": p.get("name") or bid} if extra else {**p, **no_data}
+        feats.append({**f, "properties": props})
+    return {**basins, "features": feats}
 
 def main():
     # ---- Load inputs (grace, era5, imerg) ----
@@ -94,18 +128,14 @@ def main():
         df["rain_def_z"] = np.nan
 
     # ---- ASI with weight re-normalization (ignore missing components) ----
-    comp = pd.DataFrame({
-        "twsa_z": df["twsa_z"],
-        "sm_z":   df["sm_z"],
-        "rain_z": df["rain_z"]
-    })
+    comp = np.column_stack([df[c].to_numpy(dtype=float) for c in ("twsa_z", "sm_z", "rain_z")])
     w = np.array([W_TWSA, W_SM, W_RAIN])
-    mask = comp.notna().to_numpy()
-    num  = (comp.fillna(0.0).to_numpy() * w).sum(axis=1)
-    den  = (mask * w).sum(axis=1)
+    mask = ~np.isnan(comp)
+    num  = np.where(mask, comp, 0.0) @ w
+    den  = mask @ w
     asi  = np.divide(num, den, out=np.full_like(num, np.nan, dtype=float), where=den>0)
     df["asi"] = asi
-    df["class"] = df["asi"].apply(_classify)
+    df["class"] = pd.Categorical(_classify(df["asi"].to_numpy()), categories=CLASSES)
 
     # ---- Output table ----
     df = df.sort_values(["basin_id","date"]).reset_index(drop=True)
@@ -115,8 +145,14 @@ def main():
         if c not in df.columns: df[c] = np.nan
     df_out = df[out_cols].copy()
     df_out["date"] = df_out["date"].dt.strftime("%Y-%m-%d")
-    df_out.to_csv(TABLE_OUT, index=False)
+    _write_atomic(TABLE_OUT, lambda p: df_out.to_csv(p, index=False))
     print(f"[OK] wrote {TABLE_OUT}")
+    # Parquet sidecar for the API (typed, columnar); CSV stays for external use
+    try:
+        _write_atomic(TABLE_PQ, lambda p: df_out.to_parquet(p, index=False))
+        print(f"[OK] wrote {TABLE_PQ}")
+    except ImportError:
+        print(f"[WARN] pyarrow not installed, skipped {TABLE_PQ}")
 
     # ---- Choose latest month WITH coverage ----
     df_out["date_dt"] = pd.to_datetime(df_out["date"], errors="coerce")
@@ -126,30 +162,28 @@ def main():
     latest = df_out[df_out["date_dt"] == latest_dt].copy()
     latest_str = latest_dt.strftime("%Y-%m-%d") if pd.notna(latest_dt) else None
 
-    # ---- Build GeoJSON ----
-    gj = json.loads(BASINS_GJ.read_text(encoding="utf-8"))
-    by_id = {str(r["basin_id"]): r for r in latest.to_dict(orient="records")}
-    for f in gj.get("features", []):
-        p = f.setdefault("properties", {})
-        bid = str(p.get("basin_id"))
-        row = by_id.get(bid)
-        if row:
-            p.update({
-                "date": row["date"],
-                "twsa_z": _r(row["twsa_z"]), "sm_z": _r(row["sm_z"]),
-                "rain_z": _r(row["rain_z"]), "rain_def_z": _r(row["rain_def_z"]),
-                "asi": _r(row["asi"]), "class": row["class"],
-                "name": p.get("name") or str(bid)
-            })
-        else:
-            p.update({"date": latest_str, "twsa_z": None, "sm_z": None,
-                      "rain_z": None, "rain_def_z": None, "asi": None, "class": "no-data"})
-    LATEST_GJ.write_text(json.dumps(gj, ensure_ascii=False), encoding="utf-8")
+    # ---- Build GeoJSON: per-basin properties overlay on top of basins.geojson ----
+    prop_cols = ["date", "twsa_z", "sm_z", "rain_z", "rain_def_z", "asi", "class"]
+    num_cols  = ["twsa_z", "sm_z", "rain_z", "rain_def_z", "asi"]
+    props = latest[prop_cols].copy()
+    props[num_cols] = props[num_cols].round(3)
+    props = props.astype(object).where(props.notna(), None)   # NaN -> null in one pass
+    overlay = dict(zip(latest["basin_id"].astype(str), props.to_dict(orient="records")))
+    no_data = {"date": latest_str, "twsa_z": None, "sm_z": None,
+               "rain_z": None, "rain_def_z": None, "asi": None, "class": "no-data"}
+    gj = _apply_overlay(orjson.loads(BASINS_GJ.read_bytes()), overlay, no_data)
+    _write_atomic(LATEST_GJ, lambda p: p.write_bytes(orjson.dumps(gj)))
     print(f"[OK] wrote {LATEST_GJ}")
 
-def _r(x, nd=3):
-    try: return None if pd.isna(x) else round(float(x), nd)
-    except: return None
+    # ---- Meta sidecar: lets the API answer date-range / health queries without scanning ----
+    dates = df_out["date"].dropna()
+    meta = {"min": (dates.min() if not dates.empty else None),
+            "max": (dates.max() if not dates.empty else None),
+            "mtime": TABLE_OUT.stat().st_mtime_ns,
+            "feature_count": len(gj.get("features", [])),
+            "latest_mtime": LATEST_GJ.stat().st_mtime_ns}
+    _write_atomic(META_OUT, lambda p: p.write_bytes(orjson.dumps(meta)))
+    print(f"[OK] wrote {META_OUT}")
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,8 @@
 ﻿# scripts/make_report.py
 from pathlib import Path
 from datetime import datetime, timezone
+import heapq
+import numpy as np
 import pandas as pd
 from fpdf import FPDF
 
@@ -11,34 +13,33 @@ OUT   = ROOT / "data" / "processed" / "weekly_brief.pdf"
 WATCH, ALERT = -0.5, -1.0
 
 def classify(asi):
-    if pd.isna(asi): return "no-data"
-    if asi <= ALERT: return "alert"
-    if asi <= WATCH: return "watch"
-    return "normal"
+    # vectorized: array of ASI values -> array of class labels
+    a = np.asarray(asi, dtype=float)
+    return np.select([np.isnan(a), a <= ALERT, a <= WATCH],
+                     ["no-data", "alert", "watch"], default="normal")
 
 def main():
     if not TABLE.exists():
         raise SystemExit(f"Missing table: {TABLE}")
 
-    df = pd.read_csv(TABLE)
-    df["date"] = pd.to_datetime(df["date"]).dt.to_period("M").astype(str)
-    for c in ("twsa_z","sm_z","rain_z","rain_def_z","asi"):
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
+    df = pd.read_csv(TABLE, dtype={"date": str})
+    df["asi"] = pd.to_numeric(df["asi"], errors="coerce")
 
-    nonnull = df.dropna(subset=["asi"])
+    nonnull = df.dropna(subset=["asi", "date"])
     if nonnull.empty:
         raise SystemExit("No ASI values in table yet.")
-    latest = nonnull["date"].max()
-    mon = nonnull[nonnull["date"] == latest].copy()
+    # dates are 'YYYY-MM-DD' strings: the month is the first 7 chars, no datetime parsing needed
+    latest = nonnull["date"].max()[:7]
+    mon = nonnull[nonnull["date"].str.startswith(latest)].copy()
     if "class" not in mon.columns:
-        mon["class"] = mon["asi"].apply(classify)
+        mon["class"] = classify(mon["asi"].to_numpy())
 
     counts = mon["class"].value_counts().to_dict()
     for k in ("alert","watch","normal","no-data"):
         counts.setdefault(k, 0)
 
-    top = mon.sort_values("asi").head(10)[["basin_id","asi","class"]]
+    top = heapq.nsmallest(10, mon[["basin_id","asi","class"]].itertuples(index=False, name=None),
+                          key=lambda t: t[1])
 
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
@@ -66,9 +67,7 @@ def main():
     pdf.set_font("Helvetica", "B", 13)
     pdf.cell(0, 8, "Top 10 basins to watch", ln=1)
     pdf.set_font("Helvetica", "", 11)
-    for i, (bid, asi, cls) in enumerate(
-        top[["basin_id","asi","class"]].itertuples(index=False, name=None), 1
-    ):
+    for i, (bid, asi, cls) in enumerate(top, 1):
         pdf.cell(0, 7, f"{i}. {int(bid)}  -  ASI {asi:.3f}  ({cls})", ln=1)
 
     OUT.parent.mkdir(parents=True, exist_ok=True)